@@ -8,8 +8,12 @@
 for usage.
 '''
 from __future__ import print_function
-import polib
+import io
+import os
 import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 
 import six
 
@@ -17,6 +21,19 @@ if six.PY2:
     import paste.script.command
 
 
+_SIMPLE_CONV_RE = re.compile(r'\%\w')
+_MAPPING_KEYS_RE = re.compile(r'\%\([^\)]*\)\w')
+_REPL_FIELDS_RE = re.compile(r'\{[^\}]*\}')
+_ALL_SPECS_RE = re.compile(
+    r'(?P<map>\%\([^\)]*\)\w)|(?P<conv>\%\w)|(?P<rf>\{[^\}]*\})')
+_PO_ESCAPE_RE = re.compile(r'\\[\\trn"]')
+_PO_ESCAPES = {
+    '\\\\': '\\', '\\t': '\t', '\\r': '\r', '\\n': '\n', '\\"': '"'}
+
+_PoEntry = namedtuple(
+    '_PoEntry', ['msgid', 'msgid_plural', 'msgstr', 'msgstr_plural'])
+
+
 def simple_conv_specs(s):
     '''Return the simple Python string conversion specifiers in the string s.
 
@@ -25,8 +42,7 @@ def simple_conv_specs(s):
     See http://docs.python.org/library/stdtypes.html#string-formatting
 
     '''
-    simple_conv_specs_re = re.compile(r'\%\w')
-    return simple_conv_specs_re.findall(s)
+    return _SIMPLE_CONV_RE.findall(s)
 
 
 def mapping_keys(s):
@@ -37,8 +53,7 @@ def mapping_keys(s):
     See http://docs.python.org/library/stdtypes.html#string-formatting
 
     '''
-    mapping_keys_re = re.compile(r'\%\([^\)]*\)\w')
-    return sorted(mapping_keys_re.findall(s))
+    return sorted(_MAPPING_KEYS_RE.findall(s))
 
 
 def replacement_fields(s):
@@ -49,8 +64,147 @@ def replacement_fields(s):
     See http://docs.python.org/library/string.html#formatstrings
 
     '''
-    repl_fields_re = re.compile(r'\{[^\}]*\}')
-    return sorted(repl_fields_re.findall(s))
+    return sorted(_REPL_FIELDS_RE.findall(s))
+
+
+def _extract_all(s):
+    '''Return the simple conversion specifiers, mapping keys and replacement
+    fields in the string s, in a single scan.
+
+    The result matches
+    (simple_conv_specs(s), mapping_keys(s), replacement_fields(s)), except
+    that the mapping keys and replacement fields are in the order they
+    appear in s, and that specifiers nested inside a replacement field are
+    not counted twice.
+
+    '''
+    conv_specs, keys, fields = [], [], []
+    # most strings have no specifiers at all, don't bother scanning those
+    if '%' not in s and '{' not in s:
+        return conv_specs, keys, fields
+    for match in _ALL_SPECS_RE.finditer(s):
+        group = match.lastgroup
+        if group == 'conv':
+            conv_specs.append(match.group())
+        elif group == 'map':
+            keys.append(match.group())
+        else:
+            fields.append(match.group())
+    return conv_specs, keys, fields
+
+
+@lru_cache(maxsize=4096)
+def _extract_all_cached(s):
+    '''Cached version of _extract_all(), for msgids.
+
+    The msgids are the same in every po file, so each process only needs
+    to scan them once, however many files it checks. When check_po_files()
+    uses a process pool every worker has its own cache, so each msgid is
+    scanned at most once per worker. The returned lists are shared and
+    must not be modified.
+
+    '''
+    return _extract_all(s)
+
+
+def _same_items(a, b):
+    '''Return True if the lists a and b have the same items, in any order.
+
+    Translations usually keep the specifiers in the same order, so only
+    sort the lists when they differ.
+
+    '''
+    return a == b or sorted(a) == sorted(b)
+
+
+def _unescape(s):
+    return _PO_ESCAPE_RE.sub(lambda match: _PO_ESCAPES[match.group()], s)
+
+
+def _make_po_entry(fields, fuzzy):
+    '''Return a _PoEntry for the parsed fields if it is a translated entry
+    (the same rules as polib's POEntry.translated()), otherwise None.
+
+    '''
+    msgid = fields.get('msgid')
+    if not msgid or fuzzy:
+        # no entry, the header or a fuzzy translation
+        return None
+    msgstr_plural = dict(
+        (int(key[7:-1]), value) for key, value in six.iteritems(fields)
+        if key.startswith('msgstr['))
+    msgstr = fields.get('msgstr', '')
+    if not msgstr and not (msgstr_plural and all(msgstr_plural.values())):
+        return None
+    return _PoEntry(msgid, fields.get('msgid_plural', ''), msgstr,
+                    msgstr_plural)
+
+
+def _iter_po_entries(pofile):
+    '''Yield the translated entries of a po file.
+
+    Like polib.pofile(), pofile can either be the path of a file or the po
+    contents as a string.
+
+    '''
+    try:
+        is_file = os.path.isfile(pofile)
+    except (TypeError, ValueError):
+        is_file = False
+    if is_file:
+        with io.open(pofile, encoding='utf-8') as f:
+            for entry in _parse_po_lines(f):
+                yield entry
+    else:
+        for entry in _parse_po_lines(pofile.splitlines()):
+            yield entry
+
+
+def _parse_po_lines(lines):
+    '''Yield the translated entries in the lines of a po file.
+
+    Only the msgids and msgstrs are read, which is much cheaper than
+    building full polib entries when checking big catalogs. Obsolete
+    entries and comments are skipped.
+
+    '''
+    fields = {}
+    fuzzy = False
+    field = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith('"'):
+            # continuation of the previous msgid/msgstr
+            if field is not None:
+                fields[field] += _unescape(line[1:-1])
+            continue
+
+        if not line or line.startswith(('#', 'msgctxt', 'msgid')):
+            if any(key.startswith('msgstr') for key in fields):
+                entry = _make_po_entry(fields, fuzzy)
+                if entry:
+                    yield entry
+                fields = {}
+                fuzzy = False
+            field = None
+
+        if not line:
+            continue
+        if line.startswith('#'):
+            if line.startswith('#,'):
+                # an entry can have several lines of flags
+                fuzzy = fuzzy or 'fuzzy' in [
+                    flag.strip() for flag in line[2:].split(',')]
+            elif line.startswith('#~'):
+                fuzzy = False
+            continue
+
+        field, _, value = line.partition(' ')
+        fields[field] = _unescape(value.strip()[1:-1])
+
+    entry = _make_po_entry(fields, fuzzy)
+    if entry:
+        yield entry
 
 
 if six.PY2:
@@ -66,9 +220,30 @@ if six.PY2:
 
 
 def check_po_files(paths):
-    for path in paths:
+    # files are independent of each other, so check them in parallel when
+    # there is more than one CPU to use
+    if len(paths) > 1 and (os.cpu_count() or 1) > 1:
+        with ProcessPoolExecutor() as executor:
+            futures = [executor.submit(check_po_file, path)
+                       for path in paths]
+            _print_po_files_errors(
+                zip(paths, [future.result for future in futures]))
+    else:
+        _print_po_files_errors(
+            (path, partial(check_po_file, path)) for path in paths)
+
+
+def _print_po_files_errors(checks):
+    '''Print the errors of each file in order, as they become available.
+
+    checks is an iterable of (path, get_errors) pairs. get_errors is only
+    called after the file name has been printed, so if checking one of the
+    files fails, the results of the files before it are already shown.
+
+    '''
+    for path, get_errors in checks:
         print(u'Checking file {}'.format(path))
-        errors = check_po_file(path)
+        errors = get_errors()
         if errors:
             for msgid, msgstr in errors:
                 print("Format specifiers don't match:")
@@ -79,25 +254,31 @@ def check_po_files(paths):
 def check_po_file(path):
     errors = []
 
-    def check_translation(validator, msgid, msgstr):
-        if not validator(msgid) == validator(msgstr):
+    def check_translation(msgid, msgid_specs, msgstr):
+        conv_specs, keys, fields = _extract_all(msgstr)
+        msgid_conv_specs, msgid_keys, msgid_fields = msgid_specs
+        # simple conversion specifiers are positional, so order matters
+        if not msgid_conv_specs == conv_specs:
+            errors.append((msgid, msgstr))
+        if not _same_items(msgid_keys, keys):
+            errors.append((msgid, msgstr))
+        if not _same_items(msgid_fields, fields):
             errors.append((msgid, msgstr))
 
-    po = polib.pofile(path)
-    for entry in po.translated_entries():
+    for entry in _iter_po_entries(path):
         if entry.msgid_plural and entry.msgstr_plural:
-            for function in (simple_conv_specs, mapping_keys,
-                             replacement_fields):
-                for key, msgstr in six.iteritems(entry.msgstr_plural):
-                    if key == '0':
-                        check_translation(function, entry.msgid,
-                                          entry.msgstr_plural[key])
-                    else:
-                        check_translation(function, entry.msgid_plural,
-                                          entry.msgstr_plural[key])
+            # msgid and msgid_plural are the same for every plural form, so
+            # only scan them once per entry
+            msgid_specs = _extract_all_cached(entry.msgid)
+            msgid_plural_specs = _extract_all_cached(entry.msgid_plural)
+            for key, msgstr in six.iteritems(entry.msgstr_plural):
+                if key == 0:
+                    check_translation(entry.msgid, msgid_specs, msgstr)
+                else:
+                    check_translation(entry.msgid_plural,
+                                      msgid_plural_specs, msgstr)
         elif entry.msgstr:
-            for function in (simple_conv_specs, mapping_keys,
-                             replacement_fields):
-                check_translation(function, entry.msgid, entry.msgstr)
+            check_translation(entry.msgid, _extract_all_cached(entry.msgid),
+                              entry.msgstr)
 
     return errors
@@ -0,0 +1,185 @@
+# encoding: utf-8
+
+import os
+
+import polib
+import pytest
+
+from ckan.i18n.check_po_files import (
+    check_po_file,
+    check_po_files,
+    _iter_po_entries,
+)
+
+PO_HEADER = """
+msgid ""
+msgstr ""
+"Project-Id-Version: CKAN\\n"
+"Language: ca\\n"
+"Plural-Forms: nplurals=2; plural=(n != 1);\\n"
+"""
+
+PO_ENTRIES = PO_HEADER + """
+#: ckan/lib/formatters.py:57
+msgid "November"
+msgstr "Noviembre"
+
+#, fuzzy
+msgid "December"
+msgstr "Diciembre"
+
+#, fuzzy
+#, python-format
+msgid "Fuzzy %(name)s"
+msgstr "Borroso"
+
+#, python-format
+msgid "User %s"
+msgstr "Usuario %s"
+
+msgctxt "month"
+msgid "May"
+msgstr "Mayo"
+
+msgid ""
+"Multi-line "
+"msgid with a \\"quote\\""
+msgstr "Multilínea\\tcon una \\"comilla\\"\\n"
+
+msgid "Not translated"
+msgstr ""
+
+#: ckan/lib/formatters.py:114
+msgid "{hours} hour ago"
+msgid_plural "{hours} hours ago"
+msgstr[0] "Fa {hours} hora"
+msgstr[1] "Fa {hours} hores"
+
+msgid "{days} day ago"
+msgid_plural "{days} days ago"
+msgstr[0] "Fa {days} dia"
+msgstr[1] ""
+
+#~ msgid "Obsolete"
+#~ msgstr "Obsoleto"
+"""
+
+PO_WRONG = PO_HEADER + """
+msgid "{number} dataset found for {query}"
+msgstr "Un conjunto de datos encontrado para {query}"
+"""
+
+
+def _polib_entries(content):
+    return [
+        (e.msgid, e.msgid_plural, e.msgstr, dict(e.msgstr_plural))
+        for e in polib.pofile(content).translated_entries()
+    ]
+
+
+def test_iter_po_entries():
+    entries = [tuple(e) for e in _iter_po_entries(PO_ENTRIES)]
+    assert entries == [
+        ("November", "", "Noviembre", {}),
+        ("User %s", "", "Usuario %s", {}),
+        ("May", "", "Mayo", {}),
+        (
+            'Multi-line msgid with a "quote"',
+            "",
+            'Multilínea\tcon una "comilla"\n',
+            {},
+        ),
+        (
+            "{hours} hour ago",
+            "{hours} hours ago",
+            "",
+            {0: "Fa {hours} hora", 1: "Fa {hours} hores"},
+        ),
+    ]
+
+
+def test_iter_po_entries_matches_polib():
+    entries = [tuple(e) for e in _iter_po_entries(PO_ENTRIES)]
+    assert entries == _polib_entries(PO_ENTRIES)
+
+
+def test_iter_po_entries_from_file(tmpdir):
+    po_file = tmpdir.join("ckan.po")
+    po_file.write_text(PO_ENTRIES, encoding="utf-8")
+    entries = [tuple(e) for e in _iter_po_entries(str(po_file))]
+    assert entries == _polib_entries(PO_ENTRIES)
+
+
+def test_check_po_file():
+    assert check_po_file(PO_ENTRIES) == []
+
+    errors = check_po_file(PO_WRONG)
+    assert len(errors) == 1
+    assert errors[0][0] == "{number} dataset found for {query}"
+
+
+def _write_po_files(tmpdir):
+    paths = []
+    for name, content in (("ok.po", PO_ENTRIES), ("wrong.po", PO_WRONG)):
+        po_file = tmpdir.join(name)
+        po_file.write_text(content, encoding="utf-8")
+        paths.append(str(po_file))
+    return paths
+
+
+@pytest.mark.parametrize("cpu_count", [1, 2])
+def test_check_po_files_output_order(tmpdir, capsys, monkeypatch, cpu_count):
+    monkeypatch.setattr(os, "cpu_count", lambda: cpu_count)
+    ok_path, wrong_path = _write_po_files(tmpdir)
+
+    check_po_files([wrong_path, ok_path])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "Checking file {}".format(wrong_path)
+    assert lines[1] == "Format specifiers don't match:"
+    assert lines[2].startswith("    {number} dataset found for {query} -> ")
+    assert lines[3:] == ["Checking file {}".format(ok_path)]
+
+
+@pytest.mark.parametrize("cpu_count", [1, 2])
+def test_check_po_files_unreadable_file(
+    tmpdir, capsys, monkeypatch, cpu_count
+):
+    monkeypatch.setattr(os, "cpu_count", lambda: cpu_count)
+    ok_path, wrong_path = _write_po_files(tmpdir)
+    bad_file = tmpdir.join("bad.po")
+    bad_file.write_binary(b'msgid "\xff"\nmsgstr "\xfe"\n')
+    bad_path = str(bad_file)
+
+    with pytest.raises(UnicodeDecodeError):
+        check_po_files([ok_path, bad_path, wrong_path])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == [
+        "Checking file {}".format(ok_path),
+        "Checking file {}".format(bad_path),
+    ]
+
+
+PO_PLURALS = PO_HEADER + """
+msgid "One item"
+msgid_plural "%(n)s items"
+msgstr[0] "Un elemento"
+msgstr[1] "%(n)s elementos"
+"""
+
+PO_WRONG_PLURALS = PO_HEADER + """
+msgid "One item"
+msgid_plural "%(n)s items"
+msgstr[0] "Un elemento"
+msgstr[1] "Varios elementos"
+"""
+
+
+def test_check_po_file_plurals():
+    # msgstr[0] is checked against msgid, the other forms against
+    # msgid_plural
+    assert check_po_file(PO_PLURALS) == []
+
+    errors = check_po_file(PO_WRONG_PLURALS)
+    assert errors == [("%(n)s items", "Varios elementos")]
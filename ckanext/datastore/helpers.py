@@ -2,21 +2,164 @@
 
 import json
 import logging
+import re
+from collections import OrderedDict
+from functools import lru_cache
 
 import ckan.common as converters
 import sqlparse
-import six
-
-from six import string_types
 
 from ckan.plugins.toolkit import get_action, ObjectNotFound, NotAuthorized
 
 log = logging.getLogger(__name__)
 
 
+_FTS_INDEX_FIELD_TYPES = frozenset(['tsvector', 'text', 'number'])
+_FUNCTION_NAMES_CACHE_MAX_SQL_LENGTH = 4096
+_LIST_SEPARATOR_RE = re.compile(r'\s*,\s*')
+_SQL_SPECIAL_RE = re.compile(r"""--|/\*|[;'"$]""")
+_SQL_BLOCK_COMMENT_RE = re.compile(r'/\*|\*/')
+_SQL_LINE_END_RE = re.compile(r'[\r\n]')
+_SQL_ESCAPE_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'?", re.DOTALL)
+# like Postgres, any non-ASCII character is valid in identifiers and tags
+_SQL_DOLLAR_QUOTE_RE = re.compile(
+    r'\$(?:[A-Za-z_\x80-\U0010ffff][A-Za-z0-9_\x80-\U0010ffff]*)?\$')
+
+
 def is_single_statement(sql):
-    '''Returns True if received SQL string contains at most one statement'''
-    return len(sqlparse.split(sql)) <= 1
+    '''Returns True if received SQL string contains at most one statement
+
+    The string is scanned once, skipping string literals, quoted
+    identifiers, dollar-quoted strings and comments the same way Postgres
+    does. Anything other than whitespace, comments and further semicolons
+    after the first unquoted semicolon counts as another statement.
+
+    Some string literals can be read both with and without backslash
+    escapes, depending on standard_conforming_strings and on the Postgres
+    version (see _ends_of_string_literal). For those, every reading must
+    find a single statement.
+    '''
+    pending = [0]
+    visited = set()
+    while pending:
+        single, positions = _scan_statement(sql, pending.pop(), visited)
+        if not single:
+            return False
+        pending.extend(positions)
+    return True
+
+
+def _scan_statement(sql, pos, visited):
+    '''Scans sql from pos for a second statement.
+
+    Returns a tuple (single, positions). single is False if a second
+    statement was found. If the scan stopped at an ambiguous string
+    literal, positions are where scanning has to continue for each of its
+    readings, otherwise it is empty.
+
+    visited holds the tokens already scanned by previous calls, so that
+    the different readings don't scan the same part of sql again.
+    '''
+    end_of_statement = False
+    length = len(sql)
+    while pos < length:
+        match = _SQL_SPECIAL_RE.search(sql, pos)
+        start = match.start() if match else length
+        if end_of_statement and sql[pos:start].strip():
+            return False, ()
+        if not match:
+            break
+
+        # the rest of the scan only depends on where it is and whether
+        # the statement has ended
+        state = (start, end_of_statement)
+        if state in visited:
+            break
+        visited.add(state)
+
+        token = match.group()
+        if token == ';':
+            end_of_statement = True
+            pos = match.end()
+        elif token == '--':
+            # Postgres ends line comments at either \n or \r
+            line_end = _SQL_LINE_END_RE.search(sql, start)
+            if not line_end:
+                break
+            pos = line_end.start()
+        elif token == '/*':
+            pos = _end_of_block_comment(sql, start)
+        elif end_of_statement:
+            return False, ()
+        elif token == "'":
+            ends = _ends_of_string_literal(sql, start)
+            if len(ends) > 1:
+                return True, ends
+            pos = ends[0]
+        elif token == '"':
+            pos = _end_of_quoted(sql, start, token)
+        else:
+            pos = _end_of_dollar_quoted(sql, start)
+    return True, ()
+
+
+def _is_identifier_char(c):
+    # Postgres accepts any non-ASCII character in identifiers
+    return c.isalnum() or c in '_$' or ord(c) > 127
+
+
+def _end_of_quoted(sql, start, quote):
+    '''Returns the position after the closing quote, or the end of the
+    string if it is not closed. An escaped (doubled) quote is handled as
+    two adjacent quoted items, which is equivalent for our purposes.'''
+    end = sql.find(quote, start + 1)
+    return end + len(quote) if end != -1 else len(sql)
+
+
+def _ends_of_string_literal(sql, start):
+    '''Returns a tuple with the possible positions after a string literal.
+
+    E'...' strings allow backslash escapes. Plain strings only do when
+    standard_conforming_strings is off, so if they contain a backslash
+    both readings are returned. Postgres 14 and earlier also read an E
+    right after a number (eg 1E'...') as an escape string prefix, so both
+    readings are returned for those too.'''
+    prefix = sql[max(start - 2, 0):start]
+    if prefix[-1:] in ('e', 'E'):
+        if len(prefix) == 1 or not _is_identifier_char(prefix[0]):
+            return (_SQL_ESCAPE_STRING_RE.match(sql, start).end(),)
+        ambiguous = prefix[0].isdigit()
+    else:
+        ambiguous = False
+
+    end = _end_of_quoted(sql, start, "'")
+    if ambiguous or '\\' in sql[start:end]:
+        escaped_end = _SQL_ESCAPE_STRING_RE.match(sql, start).end()
+        if escaped_end != end:
+            return (end, escaped_end)
+    return (end,)
+
+
+def _end_of_dollar_quoted(sql, start):
+    '''Returns the position after a $tag$...$tag$ string. A $ that does not
+    start one (eg a $1 parameter or part of an identifier) is skipped.'''
+    match = None
+    if not start or not _is_identifier_char(sql[start - 1]):
+        match = _SQL_DOLLAR_QUOTE_RE.match(sql, start)
+    if not match:
+        return start + 1
+    return _end_of_quoted(sql, match.end() - 1, match.group())
+
+
+def _end_of_block_comment(sql, start):
+    '''Returns the position after a /* */ comment. Postgres allows these
+    to be nested.'''
+    depth = 0
+    for match in _SQL_BLOCK_COMMENT_RE.finditer(sql, start):
+        depth += 1 if match.group() == '/*' else -1
+        if not depth:
+            return match.end()
+    return len(sql)
 
 
 def is_valid_field_name(name):
@@ -27,15 +170,17 @@ def is_valid_field_name(name):
     * can't contain double quote (")
     * can't be empty
     '''
-    return (name and name == name.strip() and
-            not name.startswith('_') and
+    return (bool(name) and name[0] != '_' and
+            not name[0].isspace() and not name[-1].isspace() and
             '"' not in name)
 
 
 def is_valid_table_name(name):
-    if '%' in name:
-        return False
-    return is_valid_field_name(name)
+    '''
+    Check that table name is valid: same rules as for field names, and
+    it can't contain percent signs (%)
+    '''
+    return is_valid_field_name(name) and '%' not in name
 
 
 def get_list(input, strip_values=True):
@@ -45,7 +190,10 @@ def get_list(input, strip_values=True):
     if input == '':
         return []
 
-    converters_list = converters.aslist(input, ',', True)
+    if isinstance(input, str):
+        converters_list = _LIST_SEPARATOR_RE.split(input.strip())
+    else:
+        converters_list = converters.aslist(input, ',', True)
     if strip_values:
         return [_strip(x) for x in converters_list]
     else:
@@ -61,13 +209,15 @@ def validate_int(i, non_negative=False):
 
 
 def _strip(s):
-    if isinstance(s, string_types) and len(s) and s[0] == s[-1]:
+    if isinstance(s, str) and len(s) and s[0] == s[-1]:
         return s.strip().strip('"')
     return s
 
 
 def should_fts_index_field_type(field_type):
-    return field_type.lower() in ['tsvector', 'text', 'number']
+    # field types are usually lowercase already, so avoid the lower() copy
+    return (field_type in _FTS_INDEX_FIELD_TYPES or
+            field_type.lower() in _FTS_INDEX_FIELD_TYPES)
 
 
 def get_table_and_function_names_from_sql(context, sql):
@@ -90,17 +240,23 @@ def get_table_and_function_names_from_sql(context, sql):
     '''
 
     queries = [sql]
+    explained = set()
     table_names = []
     function_names = []
 
     while queries:
         sql = queries.pop()
 
+        # the same crosstab subquery can show up several times, there is
+        # no need to send another EXPLAIN round-trip for it
+        if sql in explained:
+            continue
+        explained.add(sql)
+
         function_names.extend(_get_function_names_from_sql(sql))
 
         result = context['connection'].execute(
-            'EXPLAIN (VERBOSE, FORMAT JSON) {0}'.format(
-                six.ensure_str(sql))).fetchone()
+            f'EXPLAIN (VERBOSE, FORMAT JSON) {sql}').fetchone()
 
         try:
             query_plan = json.loads(result['QUERY PLAN'])
@@ -109,14 +265,14 @@ def get_table_and_function_names_from_sql(context, sql):
             t, q, f = _parse_query_plan(plan)
             table_names.extend(t)
             queries.extend(q)
-
-            function_names = list(set(function_names) | set(f))
+            function_names.extend(f)
 
         except ValueError:
             log.error('Could not parse query plan')
             raise
 
-    return table_names, function_names
+    # remove duplicates once, keeping the order in which names were found
+    return table_names, list(OrderedDict.fromkeys(function_names))
 
 
 def _parse_query_plan(plan):
@@ -133,45 +289,62 @@ def _parse_query_plan(plan):
     queries = []
     functions = []
 
-    if plan.get('Relation Name'):
-        table_names.append(plan['Relation Name'])
-    if 'Function Name' in plan:
-        if plan['Function Name'].startswith(
-                'crosstab'):
-            try:
-                queries.append(_get_subquery_from_crosstab_call(
-                    plan['Function Call']))
-            except ValueError:
-                table_names.append('_unknown_crosstab_sql')
-        else:
-            functions.append(plan['Function Name'])
-
-    if 'Plans' in plan:
-        for child_plan in plan['Plans']:
-            t, q, f = _parse_query_plan(child_plan)
-            table_names.extend(t)
-            queries.extend(q)
-            functions.extend(f)
+    # walk the plan tree depth-first without recursing, so deeply nested
+    # plans don't need a stack frame and intermediate lists per node
+    plans = [plan]
+    while plans:
+        plan = plans.pop()
+
+        if plan.get('Relation Name'):
+            table_names.append(plan['Relation Name'])
+        if 'Function Name' in plan:
+            if plan['Function Name'].startswith('crosstab'):
+                try:
+                    queries.append(_get_subquery_from_crosstab_call(
+                        plan['Function Call']))
+                except ValueError:
+                    table_names.append('_unknown_crosstab_sql')
+            else:
+                functions.append(plan['Function Name'])
+
+        if 'Plans' in plan:
+            plans.extend(reversed(plan['Plans']))
 
     return table_names, queries, functions
 
 
 def _get_function_names_from_sql(sql):
+    '''Returns a tuple with the names of the functions called in the SQL.
+    Parsing only depends on the SQL string so results are cached, to avoid
+    tokenizing the same queries over and over again. Long queries are not
+    cached, so the cache can't hold on to large amounts of memory.'''
+    if len(sql) > _FUNCTION_NAMES_CACHE_MAX_SQL_LENGTH:
+        return _parse_function_names_from_sql(sql)
+    return _cached_function_names_from_sql(sql)
+
+
+def _parse_function_names_from_sql(sql):
     function_names = []
+    seen = set()
+
+    # walk the token tree depth-first, keeping the order in which
+    # functions first appear
+    stack = list(reversed(sqlparse.parse(sql)[0].tokens))
+    while stack:
+        token = stack.pop()
+        if isinstance(token, sqlparse.sql.Function):
+            function_name = token.get_name()
+            if function_name not in seen:
+                seen.add(function_name)
+                function_names.append(function_name)
+        if token.is_group:
+            stack.extend(reversed(token.tokens))
 
-    def _get_function_names(tokens):
-        for token in tokens:
-            if isinstance(token, sqlparse.sql.Function):
-                function_name = token.get_name()
-                if function_name not in function_names:
-                    function_names.append(function_name)
-            if hasattr(token, 'tokens'):
-                _get_function_names(token.tokens)
+    return tuple(function_names)
 
-    parsed = sqlparse.parse(sql)[0]
-    _get_function_names(parsed.tokens)
 
-    return function_names
+_cached_function_names_from_sql = lru_cache(maxsize=256)(
+    _parse_function_names_from_sql)
 
 
 def _get_subquery_from_crosstab_call(ct):
@@ -194,12 +367,11 @@ def datastore_dictionary(resource_id):
     Return the data dictionary info for a resource
     """
     try:
-        return [
-            f for f in get_action('datastore_search')(
-                None, {
-                    u'resource_id': resource_id,
-                    u'limit': 0,
-                    u'include_total': False})['fields']
-            if not f['id'].startswith(u'_')]
+        fields = get_action('datastore_search')(
+            None, {
+                u'resource_id': resource_id,
+                u'limit': 0,
+                u'include_total': False})['fields']
+        return [f for f in fields if f['id'][:1] != u'_']
     except (ObjectNotFound, NotAuthorized):
         return []
@@ -32,12 +32,26 @@ class TestTypeGetters(object):
             'SELECT * FROM "bartable";',
             'SELECT * FROM "bart;able";',
             "select 'foo'||chr(59)||'bar'",
+            "SELECT 1; -- comment",
+            "SELECT 1; /* comment */",
+            "SELECT 'foo;'''",
+            "SELECT $$;$$, $tag$ $$; $tag$",
+            "SELECT E'\\';'",
+            "SELECT 'a\\b'",
+            "SELECT 1E'\\n'",
         ]
 
         multiples = [
             "SELECT * FROM abc; SET LOCAL statement_timeout to"
             "SET LOCAL statement_timeout to; SELECT * FROM abc",
             'SELECT * FROM "foo"; SELECT * FROM "abc"',
+            "SELECT 1 -- comment\n; SELECT 2",
+            "SELECT 'foo\\'; SELECT 2 --'",
+            "SELECT 1 /* /* */ ' */; SELECT 2 --'",
+            "SELECT $a·$'$a·$; DROP TABLE t; --'",
+            "SELECT 1 --x\r); DROP TABLE t; SELECT * FROM (SELECT 1",
+            "SELECT 1E'\\''; DROP TABLE t; --'",
+            "SELECT 'a\\''; DROP TABLE t; --'",
         ]
 
         for single in singles:
@@ -35,6 +35,28 @@ def test_is_valid_table_name():
     assert not helpers.is_valid_table_name("foo%bar")
 
 
+def test_get_subquery_from_crosstab_call():
+    get_subquery = helpers._get_subquery_from_crosstab_call
+    assert get_subquery("crosstab('SELECT 1'::text)") == "SELECT 1"
+    assert get_subquery(
+        "crosstab('SELECT ''a'', ''''''b'''''' FROM t'::text)"
+    ) == "SELECT 'a', '''b''' FROM t"
+    assert get_subquery("crosstab(''''''::text)") == "''"
+
+    odd_quotes = [
+        "crosstab('SELECT 'a' FROM t'::text)",
+        "crosstab('SELECT '''a''' FROM t'::text)",
+        "crosstab('''::text)",
+        "crosstab('''''::text)",
+    ]
+    for ct in odd_quotes:
+        with pytest.raises(ValueError):
+            get_subquery(ct)
+
+    with pytest.raises(ValueError):
+        get_subquery("crosstab('SELECT 1', 'SELECT 2')")
+
+
 def test_pg_version_check():
     if not tests.is_datastore_supported():
         pytest.skip("Datastore not supported")